@@ -3,48 +3,130 @@ import shutil
 import tempfile
 import uuid
 import base64
+import gzip
+import zlib
+import xml.parsers.expat
 from fastapi import APIRouter, File, UploadFile, HTTPException, Query, Header
 from fastapi.responses import Response, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 
+from app.core.config import PDF_OPTIMIZE, MAX_DECOMPRESSED_UPLOAD_MB, MAX_INSPECT_BATCH_FILES
 from app.services.pdf_service import process_xml_to_pdf, transform_xml_to_html, check_dependencies
+from app.services.peppol_service import PeppolExtractor
+from app.services.scheduler_service import SCHEDULER
+from app.services.memory_service import MEMORY_BUDGET, PeakMemorySampler, detect_attachment_sizes, estimate_request_memory
 
 router = APIRouter()
 
+class LimitedReader:
+    """Binary stream wrapper that raises 413 instead of reading past `limit` bytes."""
+
+    def __init__(self, stream, limit: int):
+        self.stream = stream
+        self.limit = limit
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        # Never read more than one byte past the limit, even for read() / read(-1)
+        remaining = self.limit - self.count + 1
+        data = self.stream.read(remaining if size is None or size < 0 else min(size, remaining))
+        self.count += len(data)
+        if self.count > self.limit:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Decompressed upload exceeds {self.limit // (1024 * 1024)} MB."
+            )
+        return data
+
+def open_upload(file: UploadFile):
+    """
+    Returns a binary stream of the upload, transparently decompressing gzip uploads.
+    Decompression stops with 413 past MAX_DECOMPRESSED_UPLOAD_MB.
+    """
+    # Clients may gzip-compress the XML upload; detect it by its magic bytes
+    is_gzip = file.file.read(2) == b"\x1f\x8b"
+    file.file.seek(0)
+    if is_gzip:
+        return LimitedReader(gzip.GzipFile(fileobj=file.file, mode="rb"), MAX_DECOMPRESSED_UPLOAD_MB * 1024 * 1024)
+    return file.file
+
+def save_upload(file: UploadFile, path: str):
+    """Writes the (decompressed) upload to `path`."""
+    with open(path, "wb") as buffer:
+        shutil.copyfileobj(open_upload(file), buffer)
+
 @router.post("/render")
 async def convert_xml_to_pdf(
     file: UploadFile = File(...), 
     lang: str = Query("en", description="Language code (en, fr, nl, de)"),
     watermark: str = Query(None, description="Watermark text to overlay on the PDF"),
     merge_attachments: bool = Query(False, description="Whether to merge embedded PDF attachments from the XML"),
-    accept: str = Header(default="application/pdf")
+    optimize: bool = Query(PDF_OPTIMIZE, description="Whether to run the PDF size optimization stage"),
+    accept: str = Header(default="application/pdf"),
+    x_priority: str = Header(default=None, description="Priority lane (interactive, bulk)"),
+    x_api_key: str = Header(default=None, description="API key, may be mapped to a priority lane")
 ):
     """
     Accepts an XML file upload, converts it to PDF or HTML, and returns the result.
     Respects Accept: text/html, application/json, or application/xml.
+    Renders are dispatched per priority lane by the weighted fair scheduler.
     """
     check_dependencies()
 
     with tempfile.TemporaryDirectory() as temp_dir:
         xml_path = os.path.join(temp_dir, f"input_{uuid.uuid4()}.xml")
         try:
-            with open(xml_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            # Decompressing a gzip upload can take a while: keep it off the event loop
+            await run_in_threadpool(save_upload, file, xml_path)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to save uploaded file: {str(e)}")
-        
-        # If user only wants HTML, we skip the PDF generation step (which is slow)
-        if "text/html" in accept:
-            html_path = os.path.join(temp_dir, f"output_{uuid.uuid4()}.html")
-            metrics = transform_xml_to_html(xml_path, html_path, lang)
-            # Remove large data not meant for headers
-            metrics.pop("sepa_qr_b64", None)
-            
-            with open(html_path, "rb") as f:
-                html_bytes = f.read()
-            return Response(content=html_bytes, media_type="text/html", headers=metrics)
 
-        # Default: Generate PDF
-        pdf_bytes, metrics, qr_code = process_xml_to_pdf(xml_path, temp_dir, lang, watermark=watermark, merge_attachments=merge_attachments)
+        # Scheduling: wait for a render slot in the request's priority lane
+        lane = SCHEDULER.resolve_lane(x_priority, x_api_key)
+        queue_wait = await SCHEDULER.acquire(lane)
+        try:
+            # Admission control: wait until the estimated memory cost fits in the global budget
+            html_only = "text/html" in accept
+            attachment_sizes = []
+            if merge_attachments and not html_only:
+                attachment_sizes = await run_in_threadpool(detect_attachment_sizes, xml_path)
+            memory_cost = estimate_request_memory(os.path.getsize(xml_path), attachment_sizes)
+            memory_wait = await MEMORY_BUDGET.acquire(memory_cost)
+            try:
+                with PeakMemorySampler() as sampler:
+                    # If user only wants HTML, we skip the PDF generation step (which is slow)
+                    if html_only:
+                        html_path = os.path.join(temp_dir, f"output_{uuid.uuid4()}.html")
+                        metrics = await run_in_threadpool(transform_xml_to_html, xml_path, html_path, lang)
+                        # Remove large data not meant for headers
+                        metrics.pop("sepa_qr_b64", None)
+
+                        with open(html_path, "rb") as f:
+                            html_bytes = f.read()
+                    else:
+                        # Default: Generate PDF
+                        pdf_bytes, metrics, qr_code = await run_in_threadpool(
+                            process_xml_to_pdf, xml_path, temp_dir, lang,
+                            watermark=watermark, merge_attachments=merge_attachments, optimize=optimize
+                        )
+            finally:
+                await MEMORY_BUDGET.release(memory_cost)
+        finally:
+            SCHEDULER.release(lane)
+
+        metrics.update({
+            "X-Perf-Queue-Lane": lane,
+            "X-Perf-Queue-Wait-Sec": f"{queue_wait:.4f}",
+            "X-Perf-Mem-Estimate-Bytes": str(memory_cost),
+            "X-Perf-Mem-Wait-Sec": f"{memory_wait:.4f}"
+        })
+        if sampler.peak_bytes is not None:
+            metrics["X-Perf-Mem-Peak-Bytes"] = str(sampler.peak_bytes)
+
+        if html_only:
+            return Response(content=html_bytes, media_type="text/html", headers=metrics)
         
         if "application/json" in accept:
             pdf_b64_str = base64.b64encode(pdf_bytes).decode('utf-8')
@@ -65,3 +147,46 @@ async def convert_xml_to_pdf(
             return Response(content=xml_content, media_type="application/xml", headers=metrics)
             
         return Response(content=pdf_bytes, media_type="application/pdf", headers=metrics)
+
+
+# Errors of a malformed, truncated or corrupt (gzip) upload
+INVALID_UPLOAD_ERRORS = (xml.parsers.expat.ExpatError, OSError, EOFError, zlib.error)
+
+# Plain `def` endpoints: FastAPI runs them in the threadpool, so parsing never blocks the event loop
+@router.post("/inspect")
+def inspect_xml(file: UploadFile = File(...)):
+    """
+    Returns routing metadata (doc type, ID, currency, payable amount, IBAN, attachment count)
+    without rendering. Uses a streaming parse that skips attachment payloads.
+    """
+    try:
+        return PeppolExtractor.inspect(open_upload(file))
+    except INVALID_UPLOAD_ERRORS as e:
+        raise HTTPException(status_code=400, detail=f"Invalid XML: {e}")
+
+
+@router.post("/inspect/batch")
+def inspect_xml_batch(files: list[UploadFile] = File(...)):
+    """
+    Batch variant of /inspect. Returns one entry per uploaded file, in order.
+    Invalid files get an `error` entry instead of failing the whole batch.
+    """
+    if len(files) > MAX_INSPECT_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files, at most {MAX_INSPECT_BATCH_FILES} per batch.")
+
+    results = []
+    for file in files:
+        try:
+            result = PeppolExtractor.inspect(open_upload(file))
+        except HTTPException as e:
+            result = {"error": e.detail}
+        except INVALID_UPLOAD_ERRORS as e:
+            result = {"error": f"Invalid XML: {e}"}
+        results.append({"filename": file.filename, **result})
+    return results
+
+
+@router.get("/metrics/scheduler")
+async def scheduler_metrics():
+    """Returns per-lane scheduler state and wait times (average, p50, p99, max)."""
+    return SCHEDULER.stats()
@@ -0,0 +1,206 @@
+"""
+Offline bulk converter.
+
+Runs the same pipeline as the /render endpoint (Saxon XSLT, Edge, post-processing)
+directly in a process pool, without the HTTP server.
+
+    python -m app.cli test_data/ -o out/ --workers 8
+    python -m app.cli --file-list files.txt -o out/ --format html
+
+Outputs are written atomically, so re-running the same command after an
+interruption skips the files that were already converted.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+from app.core.config import PDF_OPTIMIZE, ATTACHMENT_CACHE_MB
+from app.services import pdf_service
+from app.services.pdf_service import initialize_saxon, process_xml_to_pdf, transform_xml_to_html, check_dependencies
+
+# Per-worker options, set by the pool initializer
+WORKER_OPTIONS = {}
+
+# The process umask, which can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def iter_inputs(paths: list[str], file_list: str = None):
+    """
+    Yields (xml_path, anchor_dir) for every input XML file. The anchor is the input
+    directory for files found by walking one, and the file's own directory otherwise.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.lower().endswith(".xml"):
+                        yield os.path.join(dirpath, name), path
+        else:
+            yield path, os.path.dirname(path)
+
+    if file_list:
+        with open(file_list, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line, os.path.dirname(line)
+
+
+def plan_outputs(inputs: list[tuple[str, str]], output_dir: str, extension: str) -> tuple[list[tuple[str, str]], dict]:
+    """
+    Maps every input to an output path that keeps its directory structure relative to
+    the common root of all inputs, so equal file names in different directories do not
+    collide. Returns (jobs, conflicts) where conflicts maps an output path to the
+    different inputs that would all be written to it.
+    """
+    root = os.path.commonpath([os.path.abspath(anchor) for _, anchor in inputs])
+    outputs = {}
+    for xml_path, _ in inputs:
+        stem = os.path.splitext(os.path.relpath(os.path.abspath(xml_path), root))[0]
+        output_path = os.path.join(output_dir, f"{stem}.{extension}")
+        # Listing the same file twice is harmless, it is converted once
+        outputs.setdefault(os.path.normcase(output_path), (output_path, set()))[1].add(os.path.abspath(xml_path))
+
+    jobs = []
+    conflicts = {}
+    for output_path, sources in outputs.values():
+        if len(sources) > 1:
+            conflicts[output_path] = sorted(sources)
+        else:
+            jobs.append((next(iter(sources)), output_path))
+    return jobs, conflicts
+
+
+def write_atomic(output_path: str, data: bytes):
+    """Writes to a temporary file next to the output and renames it into place."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp creates the file as 0600: apply the usual umask-based mode instead
+        os.chmod(temp_path, 0o666 & ~UMASK)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _init_worker(options: dict):
+    WORKER_OPTIONS.update(options)
+    # Every worker process has its own attachment cache: give each its share of the total
+    pdf_service.ATTACHMENT_CACHE_MB = options["attachment_cache_mb"]
+    if not options.get("verbose"):
+        # The pipeline logs every step with print(); keep the progress output readable
+        sys.stdout = open(os.devnull, "w")
+    initialize_saxon()
+
+
+def _convert(job: tuple[str, str]) -> tuple[str, str | None]:
+    """Converts one file in a worker. Returns (xml_path, error)."""
+    xml_path, output_path = job
+    options = WORKER_OPTIONS
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if options["format"] == "html":
+                html_path = os.path.join(temp_dir, "output.html")
+                transform_xml_to_html(xml_path, html_path, options["lang"])
+                with open(html_path, "rb") as f:
+                    data = f.read()
+            else:
+                data, metrics, qr_code = process_xml_to_pdf(
+                    xml_path, temp_dir, options["lang"],
+                    watermark=options["watermark"],
+                    merge_attachments=options["merge_attachments"],
+                    optimize=options["optimize"]
+                )
+        write_atomic(output_path, data)
+        return xml_path, None
+    except Exception as e:
+        # HTTPException carries its message in .detail
+        return xml_path, str(getattr(e, "detail", e))
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Bulk convert Peppol XML files to PDF or HTML.")
+    parser.add_argument("inputs", nargs="*", help="XML files or directories (searched recursively for *.xml)")
+    parser.add_argument("--file-list", help="Text file with one XML path per line")
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory to write the outputs to")
+    parser.add_argument("--format", choices=["pdf", "html"], default="pdf", help="Output format (default: pdf)")
+    parser.add_argument("--lang", default="en", help="Language code (en, fr, nl, de)")
+    parser.add_argument("--watermark", default=None, help="Watermark text to overlay on the PDF")
+    parser.add_argument("--merge-attachments", action="store_true", help="Merge embedded PDF attachments from the XML")
+    parser.add_argument("--optimize", action=argparse.BooleanOptionalAction, default=PDF_OPTIMIZE, help="Run the PDF size optimization stage")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--attachment-cache-mb", type=int, default=ATTACHMENT_CACHE_MB, help="Attachment cache size shared by all workers, in MB (default: ATTACHMENT_CACHE_MB)")
+    parser.add_argument("--overwrite", action="store_true", help="Convert files even if the output already exists")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline logs of the workers")
+    args = parser.parse_args(argv)
+
+    if not args.inputs and not args.file_list:
+        parser.error("no inputs given (pass files, directories or --file-list)")
+
+    if args.format == "pdf":
+        check_dependencies()
+
+    inputs = list(iter_inputs(args.inputs, args.file_list))
+    if not inputs:
+        print("No XML files found.")
+        return 0
+
+    planned, conflicts = plan_outputs(inputs, args.output_dir, args.format)
+    if conflicts:
+        for output_path, sources in conflicts.items():
+            print(f"CONFLICT {output_path} would be written by: {', '.join(sources)}", file=sys.stderr)
+        print(f"{len(conflicts)} output path(s) are shared by several inputs, nothing was converted.", file=sys.stderr)
+        return 2
+
+    # Resume support: outputs only exist once fully written, so existing ones are done
+    jobs = []
+    skipped = 0
+    for xml_path, output_path in planned:
+        if not args.overwrite and os.path.exists(output_path):
+            skipped += 1
+            continue
+        jobs.append((xml_path, output_path))
+
+    total = len(jobs)
+    print(f"{total} file(s) to convert, {skipped} already done, {args.workers} worker(s).")
+    if not total:
+        return 0
+
+    options = {
+        "format": args.format,
+        "lang": args.lang,
+        "watermark": args.watermark,
+        "merge_attachments": args.merge_attachments,
+        "optimize": args.optimize,
+        "attachment_cache_mb": args.attachment_cache_mb // args.workers,
+        "verbose": args.verbose
+    }
+
+    failed = 0
+    start_total = time.time()
+    with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(options,)) as pool:
+        for done, (xml_path, error) in enumerate(pool.imap_unordered(_convert, jobs, chunksize=4), start=1):
+            if error:
+                failed += 1
+                print(f"FAILED {xml_path}: {error}", file=sys.stderr)
+            elapsed = time.time() - start_total
+            if done == total or done % 100 == 0 or error:
+                print(f"[{done}/{total}] {done / elapsed:.1f} files/s, {failed} failed, {elapsed:.1f}s elapsed")
+
+    elapsed = time.time() - start_total
+    print(f"Converted {total - failed}/{total} file(s) in {elapsed:.1f}s ({total / elapsed:.1f} files/s).")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
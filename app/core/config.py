@@ -15,6 +15,58 @@ XSLT_CREDITNOTE = os.getenv("XSLT_CREDITNOTE", DEFAULT_XSLT_CREDITNOTE)
 # Server
 PORT = int(os.getenv("PORT", 8000))
 
+# Uploads: maximum size of a gzip-compressed upload once decompressed
+MAX_DECOMPRESSED_UPLOAD_MB = int(os.getenv("MAX_DECOMPRESSED_UPLOAD_MB", 200))
+MAX_INSPECT_BATCH_FILES = int(os.getenv("MAX_INSPECT_BATCH_FILES", 1000))
+
+# Page numbers (and watermark) printed by Edge via paged-media CSS instead of a pypdf pass.
+# Needs Edge 131+ (@page margin boxes); the pypdf pass is still used when merging attachments.
+# Off by default until its output has been compared pixel by pixel against the pypdf overlay.
+PDF_BROWSER_STAMPING = os.getenv("PDF_BROWSER_STAMPING", "false").lower() == "true"
+
+# PDF Optimization
+PDF_OPTIMIZE = os.getenv("PDF_OPTIMIZE", "false").lower() == "true"
+PDF_OPTIMIZE_BUDGET_SEC = float(os.getenv("PDF_OPTIMIZE_BUDGET_SEC", 0.5))
+PDF_OPTIMIZE_IMAGE_MAX_PX = int(os.getenv("PDF_OPTIMIZE_IMAGE_MAX_PX", 1200))
+PDF_OPTIMIZE_IMAGE_QUALITY = int(os.getenv("PDF_OPTIMIZE_IMAGE_QUALITY", 85))
+
+# Attachment Cache (decoded and parsed PDF attachments shared across requests)
+ATTACHMENT_CACHE_MB = int(os.getenv("ATTACHMENT_CACHE_MB", 256))  # 0 disables the cache
+
+# Memory Admission Control
+MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", 2048))  # 0 disables admission control
+MEMORY_QUEUE_TIMEOUT_SEC = float(os.getenv("MEMORY_QUEUE_TIMEOUT_SEC", 30))
+MEMORY_SAMPLE_INTERVAL_SEC = float(os.getenv("MEMORY_SAMPLE_INTERVAL_SEC", 0.01))
+if 0 < MEMORY_BUDGET_MB <= ATTACHMENT_CACHE_MB:
+    raise ValueError(f"MEMORY_BUDGET_MB ({MEMORY_BUDGET_MB}) must be larger than ATTACHMENT_CACHE_MB ({ATTACHMENT_CACHE_MB}).")
+
+# Scheduling: weighted fair sharing of render slots between priority lanes
+SCHEDULER_SLOTS = int(os.getenv("SCHEDULER_SLOTS", os.cpu_count() or 4))
+SCHEDULER_DEFAULT_LANE = os.getenv("SCHEDULER_DEFAULT_LANE", "interactive").lower()
+SCHEDULER_LANES = {
+    "interactive": {
+        "weight": float(os.getenv("INTERACTIVE_WEIGHT", 4)),
+        "max_concurrency": int(os.getenv("INTERACTIVE_MAX_CONCURRENCY", SCHEDULER_SLOTS)),
+        "queue_depth": int(os.getenv("INTERACTIVE_QUEUE_DEPTH", 100)),
+    },
+    "bulk": {
+        "weight": float(os.getenv("BULK_WEIGHT", 1)),
+        # Keep a slot free for interactive renders by default
+        "max_concurrency": int(os.getenv("BULK_MAX_CONCURRENCY", max(1, SCHEDULER_SLOTS - 1))),
+        "queue_depth": int(os.getenv("BULK_QUEUE_DEPTH", 1000)),
+    },
+}
+# API keys mapped to a lane, e.g. "key1:bulk,key2:interactive"
+PRIORITY_API_KEYS = dict(
+    (key.strip(), lane.strip().lower())
+    for key, lane in (entry.split(":", 1) for entry in os.getenv("PRIORITY_API_KEYS", "").split(",") if ":" in entry)
+)
+if SCHEDULER_DEFAULT_LANE not in SCHEDULER_LANES:
+    raise ValueError(f"SCHEDULER_DEFAULT_LANE ({SCHEDULER_DEFAULT_LANE}) must be one of {', '.join(SCHEDULER_LANES)}.")
+UNKNOWN_API_KEY_LANES = set(PRIORITY_API_KEYS.values()) - set(SCHEDULER_LANES)
+if UNKNOWN_API_KEY_LANES:
+    raise ValueError(f"PRIORITY_API_KEYS maps to unknown lane(s) {', '.join(sorted(UNKNOWN_API_KEY_LANES))}, expected one of {', '.join(SCHEDULER_LANES)}.")
+
 def get_edge_path():
     env_path = os.getenv("EDGE_BIN")
     if env_path and os.path.exists(env_path):
@@ -0,0 +1,180 @@
+import os
+import time
+import asyncio
+import threading
+import xml.parsers.expat
+from collections import deque
+from fastapi import HTTPException
+
+from app.core.config import MEMORY_BUDGET_MB, MEMORY_QUEUE_TIMEOUT_SEC, MEMORY_SAMPLE_INTERVAL_SEC, ATTACHMENT_CACHE_MB
+
+# Rough multipliers for what a single request holds in RAM at the same time
+XML_TREE_FACTOR = 10                    # ET.parse of the upload (ElementTree overhead per byte)
+ATTACHMENT_FACTOR = 3                   # decoded bytes + pypdf reader + copy in the final PDF
+BASE_REQUEST_BYTES = 32 * 1024 * 1024   # HTML, overlays, rendered PDF and response encoding
+
+
+def detect_attachment_sizes(xml_path: str) -> list[int]:
+    """
+    Returns the decoded size of every embedded PDF attachment without decoding it.
+    Streams the XML with expat and only counts the base64 characters, so the
+    payloads are never held in memory.
+    """
+    sizes = []
+    counting = [False]
+
+    def start(name, attrs):
+        if name.split('}')[-1] == "EmbeddedDocumentBinaryObject":
+            mime = attrs.get("mimeCode", "").lower()
+            counting[0] = mime == "application/pdf"
+            if counting[0]:
+                sizes.append(0)
+
+    def end(name):
+        counting[0] = False
+
+    def char_data(data):
+        if counting[0]:
+            # Base64 encodes 3 bytes in 4 characters; whitespace is not part of the payload
+            sizes[-1] += len(data) - sum(data.count(c) for c in " \t\r\n")
+
+    parser = xml.parsers.expat.ParserCreate(namespace_separator='}')
+    parser.buffer_text = False
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = char_data
+    try:
+        with open(xml_path, "rb") as f:
+            parser.ParseFile(f)
+    except Exception as e:
+        print(f"Error detecting attachment sizes: {e}")
+    return [chars * 3 // 4 for chars in sizes if chars]
+
+
+def estimate_request_memory(upload_size: int, attachment_sizes: list[int] = None) -> int:
+    """Estimates the peak memory (bytes) a request needs from its upload and attachment sizes."""
+    attachment_bytes = sum(attachment_sizes or [])
+    return BASE_REQUEST_BYTES + upload_size * XML_TREE_FACTOR + attachment_bytes * ATTACHMENT_FACTOR
+
+
+def read_rss() -> int | None:
+    """Returns the resident set size of this process in bytes, or None if unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class MemoryBudget:
+    """
+    Global memory budget shared by all requests.
+    Requests are admitted in arrival order (so small requests cannot keep overtaking a
+    large one), wait until their estimated cost fits, and are rejected when it never can.
+    Runs on the event loop, so no locking.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.in_use = 0
+        self._waiters = deque()  # (cost, future) in arrival order
+
+    async def acquire(self, cost: int, timeout: float = MEMORY_QUEUE_TIMEOUT_SEC) -> float:
+        """Waits until `cost` bytes fit in the budget. Returns the time spent waiting."""
+        if self.budget_bytes <= 0:
+            return 0.0
+        if cost > self.budget_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Request needs an estimated {cost // (1024 * 1024)} MB, above the memory budget of {self.budget_bytes // (1024 * 1024)} MB."
+            )
+
+        start_wait = time.time()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((cost, future))
+        self._admit()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # wait_for cancelled the future; let the requests queued behind it through
+            self._admit()
+            raise HTTPException(
+                status_code=503,
+                detail="Server memory budget exhausted, try again later.",
+                headers={"Retry-After": str(int(timeout) or 1)}
+            )
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as the request went away
+                await self.release(cost)
+            else:
+                self._admit()
+            raise
+        return time.time() - start_wait
+
+    async def release(self, cost: int):
+        """Returns `cost` bytes to the budget and admits waiting requests."""
+        if self.budget_bytes <= 0:
+            return
+        self.in_use -= cost
+        self._admit()
+
+    def _admit(self):
+        while self._waiters:
+            cost, future = self._waiters[0]
+            if future.done():
+                # Timed out or cancelled while queued
+                self._waiters.popleft()
+                continue
+            if self.in_use + cost > self.budget_bytes:
+                return
+            self._waiters.popleft()
+            self.in_use += cost
+            future.set_result(None)
+
+
+class PeakMemorySampler:
+    """
+    Samples the process RSS in a background thread while a request runs.
+    The peak is reported as growth over the RSS at start, so it also includes
+    allocations made by requests running concurrently.
+    """
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL_SEC):
+        self.interval = interval
+        self.start_rss = None
+        self.peak_rss = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = read_rss()
+            if rss is not None and rss > self.peak_rss:
+                self.peak_rss = rss
+
+    def __enter__(self):
+        self.start_rss = read_rss()
+        self.peak_rss = self.start_rss
+        if self.start_rss is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            rss = read_rss()
+            if rss is not None and rss > self.peak_rss:
+                self.peak_rss = rss
+
+    @property
+    def peak_bytes(self) -> int | None:
+        if self.start_rss is None:
+            return None
+        return self.peak_rss - self.start_rss
+
+
+# The attachment cache may grow to ATTACHMENT_CACHE_MB at any time, so it is reserved up front
+MEMORY_BUDGET = MemoryBudget((MEMORY_BUDGET_MB - ATTACHMENT_CACHE_MB) * 1024 * 1024 if MEMORY_BUDGET_MB > 0 else 0)
@@ -1,4 +1,5 @@
 import os
+import re
 import uuid
 import platform
 import subprocess
@@ -6,7 +7,11 @@ import threading
 import urllib.parse
 import time
 import traceback
+import base64
+import hashlib
+import html
 import xml.etree.ElementTree as ET
+from collections import OrderedDict
 from saxonche import PySaxonProcessor
 from fastapi import HTTPException
 
@@ -18,13 +23,86 @@ from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 import io
 
-from app.core.config import XSLT_INVOICE, XSLT_CREDITNOTE, EDGE_PATH
+from app.core.config import (
+    XSLT_INVOICE, XSLT_CREDITNOTE, EDGE_PATH,
+    PDF_OPTIMIZE_BUDGET_SEC, PDF_OPTIMIZE_IMAGE_MAX_PX, PDF_OPTIMIZE_IMAGE_QUALITY,
+    ATTACHMENT_CACHE_MB, PDF_BROWSER_STAMPING
+)
 
 # Global State
 SAXON_PROC = None
 XSLT_CACHE = {}
 CACHE_LOCK = threading.Lock()
 
+# Cost model of optimize_pdf used to enforce the budget: the stream and object passes scale
+# with the file size, image downsampling with the decoded pixels. The starting values are
+# pessimistic so the budget applies from the first call; observed runs then refine them.
+OPTIMIZE_COST = {"sec_per_byte": 5e-8, "sec_per_pixel": 1e-6}
+OPTIMIZE_LOCK = threading.Lock()
+
+# Cost per page of numbering/watermarking in the pypdf pass (read, overlay, write; attachment
+# cloning excluded), reported as the time saved when the browser stamps the pages instead.
+# Seeded from measurements, refined by every pypdf pass.
+POSTPROCESS_SEC_PER_PAGE = 0.004
+POSTPROCESS_LOCK = threading.Lock()
+
+# Page object dictionaries (/Type /Page, but not /Type /Pages)
+PAGE_OBJECT_PATTERN = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+
+# Paged-media CSS matching the reportlab overlay of post_process_pdf: the stylesheets print
+# with 15mm page margins, so the margin box is pushed 5mm further in to end 20mm from the
+# right edge, and its 9pt text is top-aligned to put the baseline 12mm from the bottom.
+# The watermark is anchored on its baseline center, like the overlay's drawString.
+PRINT_STAMP_STYLE = """
+<style>
+    @page {
+        @bottom-right {
+            content: counter(page) " / " counter(pages);
+            font-family: Helvetica, Arial, sans-serif;
+            font-size: 9pt;
+            line-height: 1;
+            color: #999999;
+            vertical-align: top;
+            padding-top: 0.55mm;
+            padding-right: 5mm;
+        }
+    }
+    .print-watermark {
+        position: fixed;
+        top: 50%;
+        left: 50%;
+        font-family: Helvetica, Arial, sans-serif;
+        font-weight: bold;
+        font-size: 60pt;
+        line-height: 0;
+        white-space: nowrap;
+        color: rgba(217, 217, 217, 0.5);
+        transform-origin: 50% 0.27em;
+        transform: translate(-50%, -0.27em) rotate(-45deg);
+        z-index: 2147483647;
+    }
+</style>
+"""
+
+# LRU cache of parsed PDF attachments, keyed by the SHA-256 of their base64 payload
+ATTACHMENT_CACHE = OrderedDict()
+ATTACHMENT_CACHE_LOCK = threading.Lock()
+ATTACHMENT_CACHE_STATS = {"bytes": 0, "hits": 0, "misses": 0}
+# A cached PdfReader keeps every object it parsed for cloning pages, on top of the raw bytes
+CACHED_ATTACHMENT_FACTOR = 4
+
+
+class CachedAttachment:
+    """A decoded and parsed PDF attachment that can be shared across requests."""
+
+    def __init__(self, pdf_bytes: bytes):
+        self.pdf_bytes = pdf_bytes
+        # Estimated memory held while cached, counted against ATTACHMENT_CACHE_MB
+        self.memory_bytes = len(pdf_bytes) * CACHED_ATTACHMENT_FACTOR
+        self.reader = PdfReader(io.BytesIO(pdf_bytes))
+        # PdfReader reads lazily from its stream: page cloning must be serialized
+        self.lock = threading.Lock()
+
 def initialize_saxon():
     """Initializes the Saxon Processor and compiles stylesheets."""
     global SAXON_PROC
@@ -125,7 +203,7 @@ def transform_xml_to_html(xml_path: str, output_path: str, lang: str = "en") ->
     }
 
 
-def process_xml_to_pdf(xml_path: str, temp_dir: str, lang: str = "en", watermark: str = None, merge_attachments: bool = False) -> tuple[bytes, dict, str]:
+def process_xml_to_pdf(xml_path: str, temp_dir: str, lang: str = "en", watermark: str = None, merge_attachments: bool = False, optimize: bool = False) -> tuple[bytes, dict, str]:
     """
     Transforms XML to PDF.
     Returns (pdf_bytes, metrics_dict, sepa_qr_b64).
@@ -145,11 +223,20 @@ def process_xml_to_pdf(xml_path: str, temp_dir: str, lang: str = "en", watermark
     metrics = transform_xml_to_html(xml_path, html_path, lang)
     sepa_qr_b64 = metrics.pop("sepa_qr_b64", "")
     
-    # Extract attachments (if any)
+    # Extract attachments (if any); repeat attachments come from the shared cache
     attachments = []
     if merge_attachments:
-        attachments = PeppolExtractor.extract_attachments(xml_path)
+        cache_hits = 0
+        for payload in PeppolExtractor.extract_attachment_payloads(xml_path):
+            attachment, hit = load_attachment(payload)
+            cache_hits += hit
+            if attachment is not None:
+                attachments.append(attachment)
+        metrics.update(get_attachment_cache_metrics(cache_hits, len(attachments)))
     
+    # Page numbers and watermark can be printed by Edge when there is nothing to merge
+    browser_stamping = PDF_BROWSER_STAMPING and not attachments and inject_print_stamps(html_path, watermark)
+
     # 2. PDF Conversion
     start_pdf = time.time()
     abs_html_file_path = os.path.abspath(html_path)
@@ -161,8 +248,8 @@ def process_xml_to_pdf(xml_path: str, temp_dir: str, lang: str = "en", watermark
     else:
         file_url = f"file://{abs_html_file_path}"
 
-    # Edge PDF generation - Generate CLEAN pdf with NO header/footer
-    # We will add page numbers via post-processing to ensure 100% reliability.
+    # Edge PDF generation - Generate pdf with NO browser header/footer
+    # Page numbers come from the injected paged-media CSS or from post-processing.
     cmd_parts = [
         EDGE_PATH,
         "--headless",
@@ -196,9 +283,19 @@ def process_xml_to_pdf(xml_path: str, temp_dir: str, lang: str = "en", watermark
         subprocess.run(cmd_parts, check=True)
         print(f"Clean PDF generated successfully at {pdf_path}")
         
-        # Apply page numbering overlay and optional watermark
-        post_process_pdf(pdf_path, watermark_text=watermark, attachments=attachments)
-        print(f"Post-processing applied to {pdf_path}")
+        # Apply page numbering overlay, optional watermark and attachments,
+        # unless the browser already stamped the pages
+        if browser_stamping:
+            metrics["X-Perf-Postprocess-Sec"] = "0.0000"
+        else:
+            start_postprocess = time.time()
+            sec_per_page = post_process_pdf(pdf_path, watermark_text=watermark, attachments=attachments)
+            time_postprocess = time.time() - start_postprocess
+            if sec_per_page is not None:
+                update_postprocess_cost(sec_per_page)
+            metrics["X-Perf-Postprocess-Sec"] = f"{time_postprocess:.4f}"
+            print(f"Post-processing applied to {pdf_path}")
+        metrics["X-Perf-Stamping"] = "browser" if browser_stamping else "pypdf"
         
     except subprocess.CalledProcessError as e:
         print(f"PDF generation failed: {e}")
@@ -209,6 +306,11 @@ def process_xml_to_pdf(xml_path: str, temp_dir: str, lang: str = "en", watermark
         raise HTTPException(status_code=500, detail="PDF file was not created by Edge.")
     
     time_pdf = time.time() - start_pdf
+
+    # 3. Optional size optimization
+    if optimize:
+        metrics.update(optimize_pdf(pdf_path))
+
     time_total = time.time() - start_total
 
     metrics.update({
@@ -220,32 +322,136 @@ def process_xml_to_pdf(xml_path: str, temp_dir: str, lang: str = "en", watermark
     with open(pdf_path, "rb") as f:
         pdf_bytes = f.read()
 
+    if browser_stamping:
+        with POSTPROCESS_LOCK:
+            sec_per_page = POSTPROCESS_SEC_PER_PAGE
+        metrics["X-Perf-Postprocess-Saved-Sec"] = f"{sec_per_page * count_pdf_pages(pdf_bytes):.4f}"
+
     return pdf_bytes, metrics, sepa_qr_b64
 
-def post_process_pdf(pdf_path, watermark_text=None, attachments: list[bytes] = None):
+def count_pdf_pages(pdf_bytes: bytes) -> int:
+    """
+    Counts the page objects with a byte scan, which is far cheaper than parsing the PDF.
+    Falls back to pypdf when the page objects are packed in (compressed) object streams.
+    """
+    page_count = len(PAGE_OBJECT_PATTERN.findall(pdf_bytes))
+    if page_count:
+        return page_count
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+def inject_print_stamps(html_path: str, watermark_text: str = None) -> bool:
+    """
+    Adds the page numbering CSS (and the optional watermark) to the HTML so Edge prints them.
+    Returns False if the HTML has no head to inject into.
+    """
+    with open(html_path, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    head_end = content.find("</head>")
+    if head_end == -1:
+        return False
+    content = content[:head_end] + PRINT_STAMP_STYLE + content[head_end:]
+
+    if watermark_text:
+        body_end = content.rfind("</body>")
+        if body_end == -1:
+            return False
+        watermark_div = f'<div class="print-watermark">{html.escape(watermark_text)}</div>'
+        content = content[:body_end] + watermark_div + content[body_end:]
+
+    with open(html_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return True
+
+
+def update_postprocess_cost(sec_per_page: float):
+    """Refines the per-page cost of the pypdf pass (exponential moving average)."""
+    global POSTPROCESS_SEC_PER_PAGE
+    with POSTPROCESS_LOCK:
+        POSTPROCESS_SEC_PER_PAGE = 0.8 * POSTPROCESS_SEC_PER_PAGE + 0.2 * sec_per_page
+
+
+def load_attachment(payload: str) -> tuple["CachedAttachment | None", bool]:
+    """
+    Returns the parsed attachment for a base64 payload and whether it came from the cache.
+    Repeat attachments only cost a hash lookup; invalid ones return None.
+    """
+    key = hashlib.sha256(payload.encode("ascii", "ignore")).hexdigest()
+    with ATTACHMENT_CACHE_LOCK:
+        attachment = ATTACHMENT_CACHE.get(key)
+        if attachment is not None:
+            ATTACHMENT_CACHE.move_to_end(key)
+            ATTACHMENT_CACHE_STATS["hits"] += 1
+            return attachment, True
+        ATTACHMENT_CACHE_STATS["misses"] += 1
+
+    try:
+        attachment = CachedAttachment(base64.b64decode(payload))
+    except Exception as e:
+        print(f"Skipping invalid attachment: {e}")
+        return None, False
+
+    budget = ATTACHMENT_CACHE_MB * 1024 * 1024
+    if attachment.memory_bytes <= budget:
+        with ATTACHMENT_CACHE_LOCK:
+            if key not in ATTACHMENT_CACHE:
+                ATTACHMENT_CACHE[key] = attachment
+                ATTACHMENT_CACHE_STATS["bytes"] += attachment.memory_bytes
+            # Evict least recently used attachments until we are within budget
+            while ATTACHMENT_CACHE_STATS["bytes"] > budget:
+                _, evicted = ATTACHMENT_CACHE.popitem(last=False)
+                ATTACHMENT_CACHE_STATS["bytes"] -= evicted.memory_bytes
+    return attachment, False
+
+
+def get_attachment_cache_metrics(request_hits: int, request_total: int) -> dict:
+    """Returns the attachment cache metrics for a request, plus the global hit rate."""
+    with ATTACHMENT_CACHE_LOCK:
+        lookups = ATTACHMENT_CACHE_STATS["hits"] + ATTACHMENT_CACHE_STATS["misses"]
+        hit_rate = ATTACHMENT_CACHE_STATS["hits"] / lookups if lookups else 0.0
+    return {
+        "X-Perf-Attachment-Cache-Hits": f"{request_hits}/{request_total}",
+        "X-Perf-Attachment-Cache-Hit-Rate": f"{hit_rate:.4f}"
+    }
+
+
+def post_process_pdf(pdf_path, watermark_text=None, attachments: list = None):
     """
     Overlays page numbers (1 / N) and optional watermark onto the PDF.
-    Also merges any attachments found in the XML.
+    Also merges any attachments found in the XML (raw bytes or CachedAttachment).
+    Returns the seconds spent per page, attachment loading excluded, or None on failure.
     """
+    start_postprocess = time.time()
+    time_attachments = 0.0
     try:
         # Load main generated PDF
         reader = PdfReader(pdf_path)
-        all_pages = []
-        all_pages.extend(reader.pages)
+        writer = PdfWriter()
+        for page in reader.pages:
+            writer.add_page(page)
         
-        # Load and append attachments
+        # Load and append attachments. Pages are cloned into the writer so the
+        # overlays below never modify a (possibly cached) attachment reader.
         if attachments:
-            for att_bytes in attachments:
+            start_attachments = time.time()
+            merged = set()
+            for attachment in attachments:
                 try:
-                    att_reader = PdfReader(io.BytesIO(att_bytes))
-                    all_pages.extend(att_reader.pages)
+                    # The writer shares objects of pages cloned twice from the same reader,
+                    # so an attachment repeated in one document gets its own reader
+                    if isinstance(attachment, bytes) or id(attachment) in merged:
+                        attachment = CachedAttachment(attachment if isinstance(attachment, bytes) else attachment.pdf_bytes)
+                    merged.add(id(attachment))
+                    with attachment.lock:
+                        for page in attachment.reader.pages:
+                            writer.add_page(page)
                 except Exception as e:
                     print(f"Skipping invalid attachment: {e}")
+            time_attachments = time.time() - start_attachments
 
-        writer = PdfWriter()
-        total_pages = len(all_pages)
+        total_pages = len(writer.pages)
         
-        for i, page in enumerate(all_pages):
+        for i, page in enumerate(writer.pages):
             page_number = i + 1
             
             # Create a memory buffer for the overlay (numbering + watermark)
@@ -285,10 +491,9 @@ def post_process_pdf(pdf_path, watermark_text=None, attachments: list[bytes] = N
             packet.seek(0)
             overlay_pdf = PdfReader(packet)
             
-            # Merge overlay onto the original page
-            # Note: page.merge_page modifies the page object in place
+            # Merge overlay onto the page
+            # Note: page.merge_page modifies the writer's copy of the page in place
             page.merge_page(overlay_pdf.pages[0])
-            writer.add_page(page)
             
         # Write to a temporary file first to avoid corruption (reading/writing same file)
         temp_final_path = pdf_path.replace(".pdf", "_final.pdf")
@@ -297,8 +502,113 @@ def post_process_pdf(pdf_path, watermark_text=None, attachments: list[bytes] = N
             
         # Replace original
         os.replace(temp_final_path, pdf_path)
+        return (time.time() - start_postprocess - time_attachments) / max(total_pages, 1)
             
     except Exception as e:
         print(f"Error applying post-processing: {e}")
         traceback.print_exc()
         # Non-fatal: if failing, return the clean (but unmerged) PDF
+        return None
+
+
+def get_oversized_images(page) -> list[tuple[str, int]]:
+    """
+    Returns (name, pixel count) of the page's images above PDF_OPTIMIZE_IMAGE_MAX_PX.
+    Reads the image dictionaries only, without decoding the images.
+    """
+    oversized = []
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources else None
+    if not xobjects:
+        return oversized
+    for name, ref in xobjects.get_object().items():
+        obj = ref.get_object()
+        if obj.get("/Subtype") != "/Image":
+            continue
+        width, height = int(obj.get("/Width", 0)), int(obj.get("/Height", 0))
+        if max(width, height) > PDF_OPTIMIZE_IMAGE_MAX_PX:
+            oversized.append((name, width * height))
+    return oversized
+
+
+def optimize_pdf(pdf_path, budget_sec: float = PDF_OPTIMIZE_BUDGET_SEC) -> dict:
+    """
+    Shrinks the PDF in place: compresses content streams, downsamples oversized
+    images and merges identical objects (e.g. the per-page overlay fonts).
+    Skipped when the estimated cost of the stream and object passes exceeds the
+    latency budget; images are only downsampled while their estimated cost still
+    fits in what is left of it.
+    Returns metrics.
+    """
+    size_before = os.path.getsize(pdf_path)
+    metrics = {"X-Perf-Optimize-Bytes-Before": str(size_before)}
+
+    with OPTIMIZE_LOCK:
+        sec_per_byte = OPTIMIZE_COST["sec_per_byte"]
+        sec_per_pixel = OPTIMIZE_COST["sec_per_pixel"]
+    if sec_per_byte * size_before > budget_sec:
+        print(f"Skipping PDF optimization: estimated {sec_per_byte * size_before:.4f}s exceeds budget {budget_sec}s")
+        metrics.update({
+            "X-Perf-Optimize-Sec": "0.0000",
+            "X-Perf-Optimize-Bytes-After": str(size_before),
+            "X-Perf-Optimize-Skipped": "budget"
+        })
+        return metrics
+
+    start_optimize = time.time()
+    size_after = size_before
+    time_images = 0.0
+    pixels_done = 0
+    images_skipped = 0
+    try:
+        writer = PdfWriter(clone_from=pdf_path)
+        for page in writer.pages:
+            page.compress_content_streams()
+
+        # Reserve the estimated time of the final passes, spend the rest on images
+        image_deadline = start_optimize + budget_sec - sec_per_byte * size_before
+        for page in writer.pages:
+            for name, pixels in get_oversized_images(page):
+                if time.time() + sec_per_pixel * pixels > image_deadline:
+                    images_skipped += 1
+                    continue
+                start_image = time.time()
+                image = page.images[name]
+                img = image.image
+                img.thumbnail((PDF_OPTIMIZE_IMAGE_MAX_PX, PDF_OPTIMIZE_IMAGE_MAX_PX))
+                image.replace(img, quality=PDF_OPTIMIZE_IMAGE_QUALITY)
+                time_images += time.time() - start_image
+                pixels_done += pixels
+        writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+
+        temp_optimized_path = pdf_path.replace(".pdf", "_optimized.pdf")
+        with open(temp_optimized_path, "wb") as f:
+            writer.write(f)
+
+        # Only keep the optimized file if it is actually smaller
+        if os.path.getsize(temp_optimized_path) < size_before:
+            os.replace(temp_optimized_path, pdf_path)
+            size_after = os.path.getsize(pdf_path)
+        else:
+            os.remove(temp_optimized_path)
+    except Exception as e:
+        print(f"Error optimizing PDF: {e}")
+        traceback.print_exc()
+        # Non-fatal: keep the post-processed PDF
+
+    time_optimize = time.time() - start_optimize
+    with OPTIMIZE_LOCK:
+        # Exponential moving averages keep the estimates responsive to load
+        observed = (time_optimize - time_images) / max(size_before, 1)
+        OPTIMIZE_COST["sec_per_byte"] = 0.8 * OPTIMIZE_COST["sec_per_byte"] + 0.2 * observed
+        if pixels_done:
+            observed = time_images / pixels_done
+            OPTIMIZE_COST["sec_per_pixel"] = 0.8 * OPTIMIZE_COST["sec_per_pixel"] + 0.2 * observed
+
+    metrics.update({
+        "X-Perf-Optimize-Sec": f"{time_optimize:.4f}",
+        "X-Perf-Optimize-Bytes-After": str(size_after)
+    })
+    if images_skipped:
+        metrics["X-Perf-Optimize-Images-Skipped"] = str(images_skipped)
+    return metrics
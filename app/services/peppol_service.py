@@ -1,6 +1,13 @@
 import xml.etree.ElementTree as ET
+import xml.parsers.expat
 import base64
 
+INSPECT_CHUNK_SIZE = 64 * 1024
+
+
+class _InspectDone(Exception):
+    """Raised from the expat handlers to stop parsing once everything is found."""
+
 class PeppolExtractor:
     """Service to extract domain data from Peppol UBL documents."""
     
@@ -70,15 +77,16 @@ class PeppolExtractor:
             return {}
 
     @staticmethod
-    def extract_attachments(xml_path: str) -> list[bytes]:
+    def extract_attachment_payloads(xml_path: str) -> list[str]:
         """
-        Extracts embedded PDF attachments from the XML.
+        Extracts the base64 payloads of embedded PDF attachments, without decoding them.
         Looking for:
         cac:AdditionalDocumentReference
           cac:Attachment
             cbc:EmbeddedDocumentBinaryObject mimeCode="application/pdf"
+        Whitespace is removed so the payload can be used as a stable cache key.
         """
-        attachments = []
+        payloads = []
         try:
             tree = ET.parse(xml_path)
             root = tree.getroot()
@@ -99,13 +107,107 @@ class PeppolExtractor:
                             if bin_obj.tag.split('}')[-1] == "EmbeddedDocumentBinaryObject":
                                 mime = bin_obj.attrib.get("mimeCode", "").lower()
                                 if mime == "application/pdf" and bin_obj.text:
-                                    try:
-                                        # Decode base64
-                                        pdf_bytes = base64.b64decode(bin_obj.text.strip())
-                                        attachments.append(pdf_bytes)
-                                    except Exception as e:
-                                        print(f"Failed to decode attachment: {e}")
+                                    payloads.append("".join(bin_obj.text.split()))
         except Exception as e:
             print(f"Error extracting attachments: {e}")
             
+        return payloads
+
+    @staticmethod
+    def extract_attachments(xml_path: str) -> list[bytes]:
+        """Extracts and decodes embedded PDF attachments from the XML."""
+        attachments = []
+        for payload in PeppolExtractor.extract_attachment_payloads(xml_path):
+            try:
+                # Decode base64
+                attachments.append(base64.b64decode(payload))
+            except Exception as e:
+                print(f"Failed to decode attachment: {e}")
         return attachments
+
+    @staticmethod
+    def inspect(source) -> dict:
+        """
+        Extracts routing metadata with a streaming parse, without rendering.
+        `source` is a file path or a binary file-like object.
+
+        Attachment payloads are skipped rather than decoded, and parsing stops at
+        the end of cac:LegalMonetaryTotal since only document lines follow it.
+        Raises xml.parsers.expat.ExpatError on malformed XML.
+        """
+        result = {
+            "doc_type": "",
+            "doc_id": "",
+            "currency": "",
+            "payable_amount": None,
+            "iban": "",
+            "attachment_count": 0
+        }
+        path = []   # local names of the open elements
+        text = []   # character data of the current leaf of interest
+        capture = [False]
+
+        def local(name):
+            return name.split('}')[-1]
+
+        def start(name, attrs):
+            tag = local(name)
+            path.append(tag)
+            depth = len(path)
+            if depth == 1:
+                result["doc_type"] = tag
+            elif tag == "EmbeddedDocumentBinaryObject":
+                result["attachment_count"] += 1
+            elif tag in ("InvoiceLine", "CreditNoteLine"):
+                # Lines come after the monetary totals in UBL: nothing left to find
+                raise _InspectDone()
+            capture[0] = depth > 1 and (
+                (depth == 2 and tag in ("ID", "DocumentCurrencyCode"))
+                or (tag == "PayableAmount" and path[-2] == "LegalMonetaryTotal")
+                or (tag == "ID" and path[-2] == "PayeeFinancialAccount" and not result["iban"])
+            )
+            text.clear()
+
+        def end(name):
+            tag = path.pop()
+            if capture[0]:
+                value = "".join(text).strip()
+                if tag == "PayableAmount":
+                    try:
+                        result["payable_amount"] = float(value)
+                    except ValueError:
+                        pass
+                elif tag == "DocumentCurrencyCode":
+                    result["currency"] = value
+                elif path[-1] == "PayeeFinancialAccount":
+                    result["iban"] = value.replace(" ", "")
+                else:
+                    result["doc_id"] = value
+                capture[0] = False
+            if tag == "LegalMonetaryTotal":
+                raise _InspectDone()
+
+        def char_data(data):
+            # Only buffer text we need; attachment payloads are never accumulated
+            if capture[0]:
+                text.append(data)
+
+        parser = xml.parsers.expat.ParserCreate(namespace_separator='}')
+        parser.buffer_text = False
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = char_data
+
+        stream = open(source, "rb") if isinstance(source, str) else source
+        try:
+            while True:
+                chunk = stream.read(INSPECT_CHUNK_SIZE)
+                parser.Parse(chunk, not chunk)
+                if not chunk:
+                    break
+        except _InspectDone:
+            pass
+        finally:
+            if stream is not source:
+                stream.close()
+        return result
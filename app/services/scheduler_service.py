@@ -0,0 +1,137 @@
+import time
+import asyncio
+from collections import deque
+from fastapi import HTTPException
+
+from app.core.config import SCHEDULER_SLOTS, SCHEDULER_LANES, SCHEDULER_DEFAULT_LANE, PRIORITY_API_KEYS
+
+WAIT_SAMPLES = 1000  # recent wait times kept per lane for percentiles
+
+
+class Lane:
+    """A priority class with its own weight, concurrency limit and queue."""
+
+    def __init__(self, name: str, weight: float, max_concurrency: int, queue_depth: int):
+        self.name = name
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.queue_depth = queue_depth
+        self.queue = deque()
+        self.running = 0
+        self.dispatched = 0
+        self.rejected = 0
+        # Virtual time: advances by 1/weight per dispatch, the lowest one is served next
+        self.vtime = 0.0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def can_dispatch(self) -> bool:
+        return bool(self.queue) and self.running < self.max_concurrency
+
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+
+        return {
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth,
+            "running": self.running,
+            "queued": len(self.queue),
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+            "wait_avg_sec": round(sum(waits) / len(waits), 4) if waits else 0.0,
+            "wait_p50_sec": round(percentile(0.50), 4),
+            "wait_p99_sec": round(percentile(0.99), 4),
+            "wait_max_sec": round(waits[-1], 4) if waits else 0.0,
+        }
+
+
+class FairScheduler:
+    """
+    Weighted fair scheduler for render slots.
+    Every free slot goes to the dispatchable lane with the lowest virtual time, so
+    under contention lanes share the slots in proportion to their weights, while an
+    idle lane leaves its share to the others. Runs on the event loop, so no locking.
+    """
+
+    def __init__(self, slots: int, lanes: dict):
+        self.slots = slots
+        self.running = 0
+        self.lanes = {name: Lane(name, **options) for name, options in lanes.items()}
+
+    def resolve_lane(self, priority: str = None, api_key: str = None) -> str:
+        """Picks the lane from the API key mapping, then the priority header, then the default."""
+        mapped_lane = PRIORITY_API_KEYS.get(api_key) if api_key else None
+        if mapped_lane in self.lanes:
+            return mapped_lane
+        if priority and priority.lower() in self.lanes:
+            return priority.lower()
+        return SCHEDULER_DEFAULT_LANE
+
+    async def acquire(self, lane_name: str) -> float:
+        """Waits for a render slot in the lane. Returns the time spent waiting."""
+        lane = self.lanes[lane_name]
+        if len(lane.queue) >= lane.queue_depth:
+            lane.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"The '{lane_name}' queue is full, try again later.",
+                headers={"Retry-After": "1"}
+            )
+
+        if not lane.queue and lane.running == 0:
+            # A lane becoming active must not spend credit banked while idle
+            active = [l.vtime for l in self.lanes.values() if l is not lane and (l.queue or l.running)]
+            if active:
+                lane.vtime = max(lane.vtime, min(active))
+
+        start_wait = time.time()
+        future = asyncio.get_running_loop().create_future()
+        lane.queue.append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as the request went away
+                self.release(lane_name)
+            elif future in lane.queue:
+                lane.queue.remove(future)
+            raise
+
+        wait = time.time() - start_wait
+        lane.waits.append(wait)
+        return wait
+
+    def release(self, lane_name: str):
+        """Frees the slot held by a request of the lane and dispatches the next one."""
+        self.running -= 1
+        self.lanes[lane_name].running -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < self.slots:
+            candidates = [lane for lane in self.lanes.values() if lane.can_dispatch()]
+            if not candidates:
+                return
+            lane = min(candidates, key=lambda l: l.vtime)
+            future = lane.queue.popleft()
+            if future.done():
+                continue
+            lane.vtime += 1.0 / lane.weight
+            lane.running += 1
+            lane.dispatched += 1
+            self.running += 1
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "slots": self.slots,
+            "running": self.running,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()}
+        }
+
+
+SCHEDULER = FairScheduler(SCHEDULER_SLOTS, SCHEDULER_LANES)
@@ -0,0 +1,16 @@
+"""Python client for the Peppol XML Visualizer /render API."""
+from peppol_client.client import (
+    PeppolClient,
+    AsyncPeppolClient,
+    RenderResult,
+    PeppolClientError,
+    parse_metrics,
+)
+
+__all__ = [
+    "PeppolClient",
+    "AsyncPeppolClient",
+    "RenderResult",
+    "PeppolClientError",
+    "parse_metrics",
+]
@@ -0,0 +1,293 @@
+import os
+import gzip
+import time
+import base64
+import random
+import asyncio
+import threading
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Union
+
+import httpx
+
+Source = Union[str, bytes, os.PathLike]
+
+ACCEPT_MODES = ("application/pdf", "text/html", "application/json", "application/xml")
+RETRY_STATUS_CODES = (429, 503)
+
+
+class PeppolClientError(Exception):
+    """Raised when the API returns an error or cannot be reached."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class RenderResult:
+    """Result of a /render call."""
+
+    status_code: int
+    content_type: str
+    pdf: Optional[bytes] = None
+    html: Optional[str] = None
+    qr_code_base64: Optional[str] = None
+    metrics: dict = field(default_factory=dict)
+    cache_hit: Optional[bool] = None
+
+
+def parse_metrics(headers) -> dict:
+    """
+    Parses the X-Perf-* response headers into a dict.
+    `X-Perf-Xslt-Sec: 0.0123` becomes `{"xslt_sec": 0.0123}`.
+    """
+    metrics = {}
+    for name, value in headers.items():
+        name = name.lower()
+        if not name.startswith("x-perf-"):
+            continue
+        key = name[len("x-perf-"):].replace("-", "_")
+        try:
+            metrics[key] = int(value)
+        except ValueError:
+            try:
+                metrics[key] = float(value)
+            except ValueError:
+                metrics[key] = value
+    return metrics
+
+
+def _read_source(source: Source) -> tuple[str, bytes]:
+    """Returns (filename, xml_bytes). Bytes are used as-is, anything else is a file path."""
+    if isinstance(source, bytes):
+        return "document.xml", source
+    with open(source, "rb") as f:
+        return os.path.basename(os.fspath(source)), f.read()
+
+
+def _build_request(source: Source, lang: str, watermark: Optional[str], merge_attachments: bool,
+                   optimize: Optional[bool], accept: str, compress: bool, priority: Optional[str]) -> dict:
+    if accept not in ACCEPT_MODES:
+        raise ValueError(f"Unsupported accept mode '{accept}', expected one of {ACCEPT_MODES}.")
+
+    filename, data = _read_source(source)
+    if compress:
+        # The server detects gzip uploads by their magic bytes
+        files = {"file": (f"{filename}.gz", gzip.compress(data, compresslevel=6), "application/gzip")}
+    else:
+        files = {"file": (filename, data, "text/xml")}
+
+    params = {"lang": lang, "merge_attachments": str(merge_attachments).lower()}
+    if watermark:
+        params["watermark"] = watermark
+    if optimize is not None:
+        params["optimize"] = str(optimize).lower()
+
+    headers = {"Accept": accept}
+    if priority:
+        headers["X-Priority"] = priority
+
+    return {"params": params, "files": files, "headers": headers}
+
+
+def _parse_response(response: httpx.Response, accept: str) -> RenderResult:
+    if response.status_code != 200:
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        raise PeppolClientError(f"Render failed ({response.status_code}): {detail}", response.status_code)
+
+    cache_hit = response.headers.get("X-Cache-Hit")
+    result = RenderResult(
+        status_code=response.status_code,
+        content_type=response.headers.get("Content-Type", ""),
+        metrics=parse_metrics(response.headers),
+        cache_hit=None if cache_hit is None else cache_hit == "True"
+    )
+
+    if accept == "text/html":
+        result.html = response.text
+    elif accept == "application/json":
+        content = response.json()
+        result.pdf = base64.b64decode(content["pdf_base64"].split(",", 1)[-1])
+        result.qr_code_base64 = content.get("qr_code_base64")
+    elif accept == "application/xml":
+        root = ET.fromstring(response.content)
+        result.pdf = base64.b64decode(root.findtext("pdf_base64", ""))
+        result.qr_code_base64 = root.findtext("qr_code_base64")
+    else:
+        result.pdf = response.content
+    return result
+
+
+def _retry_delay(response: Optional[httpx.Response], attempt: int, backoff: float) -> float:
+    """Honours Retry-After, otherwise exponential backoff with jitter."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+
+class PeppolClient:
+    """
+    Synchronous client with pooled keep-alive connections.
+    Thread-safe: a single instance can be shared by many threads.
+    """
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8000", timeout: float = 120.0,
+                 max_connections: int = 10, retries: int = 3, backoff: float = 0.5,
+                 compress: bool = True, priority: Optional[str] = None,
+                 client: Optional[httpx.Client] = None):
+        self.retries = retries
+        self.backoff = backoff
+        self.compress = compress
+        self.priority = priority
+        self.max_connections = max_connections
+        self._client = client or httpx.Client(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._client.close()
+
+    def render(self, source: Source, lang: str = "en", watermark: Optional[str] = None,
+               merge_attachments: bool = False, optimize: Optional[bool] = None,
+               accept: str = "application/pdf") -> RenderResult:
+        """Renders one XML document (file path or bytes)."""
+        request = _build_request(source, lang, watermark, merge_attachments, optimize, accept, self.compress, self.priority)
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = self._client.post("/render", **request)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise PeppolClientError(f"Request failed: {e}") from e
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                    return _parse_response(response, accept)
+            time.sleep(_retry_delay(response, attempt, self.backoff))
+
+    def render_many(self, sources: Iterable[Source], concurrency: Optional[int] = None,
+                    return_exceptions: bool = False, **options) -> list:
+        """
+        Renders many documents over the shared connection pool.
+        Results are returned in input order.
+        """
+        # A fixed pool of workers pulls from the sources, so huge batches are never queued up front
+        sources = enumerate(sources)
+        sources_lock = threading.Lock()
+        results = {}
+        failed = threading.Event()
+
+        def worker():
+            while not failed.is_set():
+                with sources_lock:
+                    index, source = next(sources, (None, None))
+                if index is None:
+                    return
+                try:
+                    results[index] = self.render(source, **options)
+                except PeppolClientError as e:
+                    if not return_exceptions:
+                        failed.set()
+                        raise
+                    results[index] = e
+
+        workers = concurrency or self.max_connections
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(worker) for _ in range(workers)]:
+                future.result()
+        return [results[index] for index in range(len(results))]
+
+
+class AsyncPeppolClient:
+    """Asyncio client with pooled keep-alive connections and bounded batch concurrency."""
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8000", timeout: float = 120.0,
+                 max_connections: int = 10, retries: int = 3, backoff: float = 0.5,
+                 compress: bool = True, priority: Optional[str] = None,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.retries = retries
+        self.backoff = backoff
+        self.compress = compress
+        self.priority = priority
+        self.max_connections = max_connections
+        self._client = client or httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def render(self, source: Source, lang: str = "en", watermark: Optional[str] = None,
+                     merge_attachments: bool = False, optimize: Optional[bool] = None,
+                     accept: str = "application/pdf") -> RenderResult:
+        """Renders one XML document (file path or bytes)."""
+        # Reading and compressing the file would block the event loop
+        request = await asyncio.to_thread(
+            _build_request, source, lang, watermark, merge_attachments, optimize, accept, self.compress, self.priority
+        )
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = await self._client.post("/render", **request)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise PeppolClientError(f"Request failed: {e}") from e
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                    return _parse_response(response, accept)
+            await asyncio.sleep(_retry_delay(response, attempt, self.backoff))
+
+    async def render_many(self, sources: Iterable[Source], concurrency: Optional[int] = None,
+                          return_exceptions: bool = False, **options) -> list:
+        """
+        Renders many documents with at most `concurrency` requests in flight.
+        Results are returned in input order.
+        """
+        # A fixed pool of workers pulls from the sources, so huge batches are never queued up front
+        sources = enumerate(sources)
+        results = {}
+
+        async def worker():
+            for index, source in sources:
+                try:
+                    results[index] = await self.render(source, **options)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results[index] = e
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency or self.max_connections)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        return [results[index] for index in range(len(results))]
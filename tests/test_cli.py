@@ -0,0 +1,63 @@
+import os
+import stat
+
+from app import cli
+from app.cli import plan_outputs, write_atomic, main, UMASK
+from app.services import pdf_service
+
+
+def test_plan_outputs_keeps_directory_structure(tmp_path):
+    inputs = [
+        (str(tmp_path / "a" / "inv.xml"), str(tmp_path / "a")),
+        (str(tmp_path / "b" / "inv.xml"), str(tmp_path / "b")),
+        (str(tmp_path / "b" / "inv.xml"), str(tmp_path / "b")),
+    ]
+    jobs, conflicts = plan_outputs(inputs, "out", "pdf")
+    assert conflicts == {}
+    assert sorted(output for _, output in jobs) == [os.path.join("out", "a", "inv.pdf"), os.path.join("out", "b", "inv.pdf")]
+
+
+def test_plan_outputs_reports_conflicts(tmp_path):
+    inputs = [
+        (str(tmp_path / "inv.xml"), str(tmp_path)),
+        (str(tmp_path / "inv.XML"), str(tmp_path)),
+    ]
+    jobs, conflicts = plan_outputs(inputs, "out", "html")
+    assert jobs == []
+    assert list(conflicts) == [os.path.join("out", "inv.html")]
+
+
+def test_write_atomic_applies_umask_mode(tmp_path):
+    output_path = tmp_path / "sub" / "out.pdf"
+    write_atomic(str(output_path), b"%PDF")
+    assert output_path.read_bytes() == b"%PDF"
+    assert stat.S_IMODE(os.stat(output_path).st_mode) == 0o666 & ~UMASK
+    assert os.listdir(tmp_path / "sub") == ["out.pdf"]
+
+
+def test_attachment_cache_is_split_between_workers(tmp_path, monkeypatch):
+    (tmp_path / "inv.xml").write_text("<Invoice/>")
+    pool_options = {}
+
+    class Pool:
+        def __init__(self, processes, initializer, initargs):
+            pool_options.update(initargs[0])
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def imap_unordered(self, func, jobs, chunksize):
+            return iter([])
+
+    monkeypatch.setattr(cli.multiprocessing, "Pool", Pool)
+    main([str(tmp_path), "-o", str(tmp_path / "out"), "--format", "html", "--workers", "4", "--attachment-cache-mb", "100"])
+    assert pool_options["attachment_cache_mb"] == 25
+
+    monkeypatch.setattr(cli, "WORKER_OPTIONS", {})
+    monkeypatch.setattr(cli, "initialize_saxon", lambda: None)
+    monkeypatch.setattr(pdf_service, "ATTACHMENT_CACHE_MB", pdf_service.ATTACHMENT_CACHE_MB)
+    cli._init_worker({**pool_options, "verbose": True})
+    assert pdf_service.ATTACHMENT_CACHE_MB == 25
@@ -0,0 +1,139 @@
+import os
+import re
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.pdf_service import initialize_saxon
+from peppol_client import PeppolClient, AsyncPeppolClient, PeppolClientError, parse_metrics
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_data")
+INVOICE_XML = os.path.join(TEST_DATA, "peppol-sample-invoice.xml")
+CREDITNOTE_XML = os.path.join(TEST_DATA, "peppol-sample-creditnote.xml")
+
+# Edge is not available outside the container, so the in-process tests use the HTML mode
+
+
+@pytest.fixture(scope="module")
+def test_client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="module")
+def client(test_client):
+    # Closed together with the TestClient
+    return PeppolClient(client=test_client)
+
+
+def test_render_html_with_gzip_upload(client):
+    result = client.render(INVOICE_XML, accept="text/html")
+    assert result.status_code == 200
+    assert "<html" in result.html.lower()
+    assert result.cache_hit is True
+    assert isinstance(result.metrics["xslt_sec"], float)
+
+
+def test_render_many_keeps_input_order(client):
+    results = client.render_many([INVOICE_XML, CREDITNOTE_XML, INVOICE_XML], concurrency=2, accept="text/html")
+    assert [r.status_code for r in results] == [200, 200, 200]
+    assert results[0].html == results[2].html
+
+
+def test_async_render_many():
+    initialize_saxon()
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        http_client = httpx.AsyncClient(transport=transport, base_url="http://testserver")
+        async with AsyncPeppolClient(client=http_client, compress=False) as async_client:
+            return await async_client.render_many([INVOICE_XML, CREDITNOTE_XML], concurrency=2, accept="text/html")
+
+    results = asyncio.run(run())
+    assert all(r.html for r in results)
+
+
+def test_retries_on_503():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) < 3:
+            return httpx.Response(503, headers={"Retry-After": "0"}, json={"detail": "busy"})
+        return httpx.Response(200, content=b"%PDF-1.7", headers={"X-Perf-Total-Sec": "1.5000"})
+
+    http_client = httpx.Client(transport=httpx.MockTransport(handler), base_url="http://testserver")
+    with PeppolClient(client=http_client) as peppol_client:
+        result = peppol_client.render(b"<Invoice/>")
+    assert len(calls) == 3
+    assert result.pdf == b"%PDF-1.7"
+    assert result.metrics == {"total_sec": 1.5}
+
+
+def test_gives_up_after_retries():
+    http_client = httpx.Client(
+        transport=httpx.MockTransport(lambda request: httpx.Response(429, headers={"Retry-After": "0"})),
+        base_url="http://testserver"
+    )
+    with PeppolClient(client=http_client, retries=1) as peppol_client:
+        with pytest.raises(PeppolClientError) as exc_info:
+            peppol_client.render(b"<Invoice/>")
+    assert exc_info.value.status_code == 429
+
+
+def test_parse_metrics():
+    metrics = parse_metrics({"X-Perf-Xslt-Sec": "0.0100", "X-Perf-Mem-Peak-Bytes": "2048", "Content-Type": "text/html"})
+    assert metrics == {"xslt_sec": 0.01, "mem_peak_bytes": 2048}
+
+
+def test_priority_lane_is_reported(test_client):
+    peppol_client = PeppolClient(client=test_client, priority="bulk")
+    result = peppol_client.render(INVOICE_XML, accept="text/html")
+    stats = test_client.get("/metrics/scheduler").json()
+    assert result.metrics["queue_lane"] == "bulk"
+    assert stats["lanes"]["bulk"]["dispatched"] >= 1
+
+
+def test_async_render_many_pulls_sources_lazily():
+    pulled = []
+
+    def sources(count):
+        for index in range(count):
+            pulled.append(index)
+            yield f"<Invoice><ID>{index}</ID></Invoice>".encode()
+
+    pulled_at_request = []
+
+    async def handler(request):
+        pulled_at_request.append(len(pulled))
+        await asyncio.sleep(0.001)
+        # Echo the document ID to check the result order
+        return httpx.Response(200, content=re.search(rb"<ID>(\d+)</ID>", request.content).group(1))
+
+    async def run():
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://testserver")
+        async with AsyncPeppolClient(client=http_client, compress=False) as async_client:
+            return await async_client.render_many(sources(50), concurrency=4)
+
+    results = asyncio.run(run())
+    # Sources are taken from the iterator as workers free up, never more than 4 ahead
+    assert all(count <= done + 4 for done, count in enumerate(pulled_at_request))
+    assert [r.pdf for r in results] == [str(index).encode() for index in range(50)]
+
+
+def test_render_many_keeps_order_with_exceptions():
+    def handler(request):
+        if b"<Bad/>" in request.content:
+            return httpx.Response(400, json={"detail": "bad"})
+        return httpx.Response(200, content=b"%PDF-1.7")
+
+    sources = [b"<Invoice/>", b"<Bad/>", b"<Invoice/>"] * 5
+    http_client = httpx.Client(transport=httpx.MockTransport(handler), base_url="http://testserver")
+    with PeppolClient(client=http_client, compress=False) as peppol_client:
+        results = peppol_client.render_many(iter(sources), concurrency=3, return_exceptions=True)
+        with pytest.raises(PeppolClientError):
+            peppol_client.render_many(sources, concurrency=3)
+    assert [isinstance(r, PeppolClientError) for r in results] == [source == b"<Bad/>" for source in sources]
@@ -0,0 +1,59 @@
+import base64
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.memory_service import MemoryBudget, detect_attachment_sizes
+
+
+def test_detect_attachment_sizes(tmp_path):
+    payload = base64.b64encode(b"%PDF" * 300).decode()
+    wrapped = "\n".join(payload[i:i + 76] for i in range(0, len(payload), 76))
+    xml_path = tmp_path / "invoice.xml"
+    xml_path.write_text(
+        '<Invoice xmlns:cbc="urn:cbc"><cbc:EmbeddedDocumentBinaryObject mimeCode="application/pdf">'
+        f'{wrapped}</cbc:EmbeddedDocumentBinaryObject>'
+        '<cbc:EmbeddedDocumentBinaryObject mimeCode="image/png">AAAA</cbc:EmbeddedDocumentBinaryObject></Invoice>'
+    )
+    assert detect_attachment_sizes(str(xml_path)) == [1200]
+
+
+def test_budget_admits_in_arrival_order():
+    async def run():
+        budget = MemoryBudget(100)
+        order = []
+        await budget.acquire(60)
+
+        async def request(name, cost):
+            await budget.acquire(cost)
+            order.append(name)
+
+        large = asyncio.create_task(request("large", 80))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(request("small", 10))
+        await asyncio.sleep(0)
+        # The small request fits, but must not overtake the large one queued before it
+        assert order == []
+        await budget.release(60)
+        await asyncio.gather(large, small)
+        assert order == ["large", "small"]
+
+    asyncio.run(run())
+
+
+def test_budget_rejects_oversized_and_times_out():
+    async def run():
+        budget = MemoryBudget(100)
+        with pytest.raises(HTTPException) as exc_info:
+            await budget.acquire(101)
+        assert exc_info.value.status_code == 413
+
+        await budget.acquire(90)
+        with pytest.raises(HTTPException) as exc_info:
+            await budget.acquire(50, timeout=0.01)
+        assert exc_info.value.status_code == 503
+        # The timed-out waiter no longer blocks the queue
+        assert await budget.acquire(10, timeout=0.01) >= 0
+
+    asyncio.run(run())
@@ -0,0 +1,203 @@
+import os
+import base64
+import shutil
+
+import pytest
+from PIL import Image
+from pypdf import PdfReader
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from app.services import pdf_service
+from app.services.pdf_service import (
+    CACHED_ATTACHMENT_FACTOR, PDF_OPTIMIZE_IMAGE_MAX_PX, load_attachment, post_process_pdf, optimize_pdf,
+    inject_print_stamps, count_pdf_pages, process_xml_to_pdf
+)
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_data")
+INVOICE_XML = os.path.join(TEST_DATA, "peppol-sample-invoice.xml")
+HTML = "<html><head><title>Invoice</title></head><body><p>Invoice</p></body></html>"
+
+
+def make_pdf(path, text, pages=1, image_size=None):
+    can = canvas.Canvas(str(path))
+    for _ in range(pages):
+        can.drawString(100, 700, text)
+        if image_size:
+            image = Image.radial_gradient("L").resize(image_size).convert("RGB")
+            can.drawImage(ImageReader(image), 50, 50, width=300, height=200)
+        can.showPage()
+    can.save()
+
+
+def page_texts(pdf_path):
+    return [" ".join(page.extract_text().split()) for page in PdfReader(str(pdf_path)).pages]
+
+
+@pytest.fixture
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(pdf_service, "ATTACHMENT_CACHE", pdf_service.OrderedDict())
+    monkeypatch.setattr(pdf_service, "ATTACHMENT_CACHE_STATS", {"bytes": 0, "hits": 0, "misses": 0})
+
+
+def test_cached_attachment_merges_across_requests(tmp_path, empty_cache):
+    make_pdf(tmp_path / "main.pdf", "MAIN", pages=2)
+    make_pdf(tmp_path / "terms.pdf", "TERMS")
+    payload = base64.b64encode((tmp_path / "terms.pdf").read_bytes()).decode()
+
+    for request in range(2):
+        attachment, hit = load_attachment(payload)
+        assert hit == (request > 0)
+        output = tmp_path / f"out{request}.pdf"
+        shutil.copy(tmp_path / "main.pdf", output)
+        post_process_pdf(str(output), watermark_text="COPY", attachments=[attachment])
+        # The overlay must not accumulate on the cached reader's pages
+        assert page_texts(output) == ["MAIN 1 / 3 COPY", "MAIN 2 / 3 COPY", "TERMS 3 / 3 COPY"]
+
+
+def test_same_attachment_twice_in_one_document(tmp_path, empty_cache):
+    make_pdf(tmp_path / "main.pdf", "MAIN")
+    make_pdf(tmp_path / "terms.pdf", "TERMS")
+    payload = base64.b64encode((tmp_path / "terms.pdf").read_bytes()).decode()
+
+    first, _ = load_attachment(payload)
+    second, hit = load_attachment(payload)
+    assert hit and first is second
+    post_process_pdf(str(tmp_path / "main.pdf"), attachments=[first, second])
+    assert page_texts(tmp_path / "main.pdf") == ["MAIN 1 / 3", "TERMS 2 / 3", "TERMS 3 / 3"]
+
+
+def test_cache_counts_parsed_overhead(tmp_path, empty_cache):
+    make_pdf(tmp_path / "terms.pdf", "TERMS")
+    pdf_bytes = (tmp_path / "terms.pdf").read_bytes()
+    load_attachment(base64.b64encode(pdf_bytes).decode())
+    assert pdf_service.ATTACHMENT_CACHE_STATS["bytes"] == len(pdf_bytes) * CACHED_ATTACHMENT_FACTOR
+
+
+@pytest.fixture
+def optimize_cost(monkeypatch):
+    cost = {"sec_per_byte": 5e-8, "sec_per_pixel": 1e-6}
+    monkeypatch.setattr(pdf_service, "OPTIMIZE_COST", cost)
+    return cost
+
+
+def image_sizes(pdf_path):
+    return [image.image.size for page in PdfReader(str(pdf_path)).pages for image in page.images]
+
+
+def test_optimize_skipped_over_budget(tmp_path, optimize_cost):
+    make_pdf(tmp_path / "doc.pdf", "DOC", image_size=(2400, 1600))
+    original = (tmp_path / "doc.pdf").read_bytes()
+
+    metrics = optimize_pdf(str(tmp_path / "doc.pdf"), budget_sec=1e-6)
+    assert metrics["X-Perf-Optimize-Skipped"] == "budget"
+    assert metrics["X-Perf-Optimize-Bytes-After"] == str(len(original))
+    assert (tmp_path / "doc.pdf").read_bytes() == original
+
+
+def test_optimize_downsamples_oversized_images(tmp_path, optimize_cost):
+    make_pdf(tmp_path / "doc.pdf", "DOC", image_size=(2400, 1600))
+
+    metrics = optimize_pdf(str(tmp_path / "doc.pdf"), budget_sec=100)
+    assert "X-Perf-Optimize-Skipped" not in metrics
+    assert int(metrics["X-Perf-Optimize-Bytes-After"]) < int(metrics["X-Perf-Optimize-Bytes-Before"])
+    assert image_sizes(tmp_path / "doc.pdf") == [(PDF_OPTIMIZE_IMAGE_MAX_PX, PDF_OPTIMIZE_IMAGE_MAX_PX * 2 // 3)]
+    assert page_texts(tmp_path / "doc.pdf") == ["DOC"]
+
+
+def test_optimize_keeps_original_unless_smaller(tmp_path, optimize_cost):
+    make_pdf(tmp_path / "doc.pdf", "DOC")
+    optimize_pdf(str(tmp_path / "doc.pdf"), budget_sec=100)
+    optimized = (tmp_path / "doc.pdf").read_bytes()
+
+    # A second pass has nothing left to gain
+    metrics = optimize_pdf(str(tmp_path / "doc.pdf"), budget_sec=100)
+    assert metrics["X-Perf-Optimize-Bytes-After"] == metrics["X-Perf-Optimize-Bytes-Before"]
+    assert (tmp_path / "doc.pdf").read_bytes() == optimized
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["doc.pdf"]
+
+
+def test_optimize_skips_images_over_remaining_budget(tmp_path, optimize_cost):
+    make_pdf(tmp_path / "doc.pdf", "DOC", pages=2, image_size=(2400, 1600))
+    # Each image is estimated at 2400 * 1600 seconds, far over the budget
+    optimize_cost["sec_per_pixel"] = 1.0
+
+    metrics = optimize_pdf(str(tmp_path / "doc.pdf"), budget_sec=100)
+    assert metrics["X-Perf-Optimize-Images-Skipped"] == "2"
+    assert image_sizes(tmp_path / "doc.pdf") == [(2400, 1600), (2400, 1600)]
+
+
+def test_inject_print_stamps_escapes_watermark(tmp_path):
+    html_path = tmp_path / "doc.html"
+    html_path.write_text(HTML, encoding="utf-8")
+
+    assert inject_print_stamps(str(html_path), "<b>DRAFT</b> & co")
+    content = html_path.read_text(encoding="utf-8")
+    assert content.index("@bottom-right") < content.index("</head>")
+    assert '<div class="print-watermark">&lt;b&gt;DRAFT&lt;/b&gt; &amp; co</div></body>' in content
+
+
+@pytest.mark.parametrize("content, watermark", [
+    ("<html><body><p>Invoice</p></body></html>", None),
+    ("<html><head></head><p>Invoice</p></html>", "DRAFT"),
+])
+def test_inject_print_stamps_needs_head_and_body(tmp_path, content, watermark):
+    html_path = tmp_path / "doc.html"
+    html_path.write_text(content, encoding="utf-8")
+
+    assert not inject_print_stamps(str(html_path), watermark)
+    # The pypdf pass stamps the untouched HTML instead
+    assert html_path.read_text(encoding="utf-8") == content
+
+
+def test_count_pdf_pages(tmp_path):
+    make_pdf(tmp_path / "doc.pdf", "DOC", pages=3)
+    assert count_pdf_pages((tmp_path / "doc.pdf").read_bytes()) == 3
+
+
+@pytest.fixture
+def fake_render(tmp_path, monkeypatch):
+    """Runs process_xml_to_pdf without Saxon and Edge. Returns the HTML Edge was given."""
+    printed = {}
+
+    def transform(xml_path, output_path, lang="en"):
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(HTML)
+        return {}
+
+    def run(cmd, check):
+        html_path = cmd[-1][len("file://"):]
+        with open(html_path, encoding="utf-8") as f:
+            printed["html"] = f.read()
+        pdf_path = next(part for part in cmd if part.startswith("--print-to-pdf="))[len("--print-to-pdf="):]
+        make_pdf(pdf_path, "PAGE", pages=2)
+
+    monkeypatch.setattr(pdf_service, "SAXON_PROC", object())
+    monkeypatch.setattr(pdf_service, "transform_xml_to_html", transform)
+    monkeypatch.setattr(pdf_service.subprocess, "run", run)
+    monkeypatch.setattr(pdf_service, "PDF_BROWSER_STAMPING", True)
+    return printed
+
+
+def test_browser_stamping_skips_pypdf_pass(tmp_path, fake_render):
+    pdf_bytes, metrics, _ = process_xml_to_pdf(INVOICE_XML, str(tmp_path), watermark="DRAFT")
+    assert metrics["X-Perf-Stamping"] == "browser"
+    assert metrics["X-Perf-Postprocess-Sec"] == "0.0000"
+    assert float(metrics["X-Perf-Postprocess-Saved-Sec"]) == pytest.approx(2 * pdf_service.POSTPROCESS_SEC_PER_PAGE, abs=1e-4)
+    assert "print-watermark" in fake_render["html"]
+    # No overlay was added
+    (tmp_path / "out.pdf").write_bytes(pdf_bytes)
+    assert page_texts(tmp_path / "out.pdf") == ["PAGE", "PAGE"]
+
+
+def test_browser_stamping_falls_back_to_pypdf_with_attachments(tmp_path, fake_render, empty_cache, monkeypatch):
+    make_pdf(tmp_path / "terms.pdf", "TERMS")
+    payload = base64.b64encode((tmp_path / "terms.pdf").read_bytes()).decode()
+    monkeypatch.setattr(pdf_service.PeppolExtractor, "extract_attachment_payloads", staticmethod(lambda xml_path: [payload]))
+
+    pdf_bytes, metrics, _ = process_xml_to_pdf(INVOICE_XML, str(tmp_path), merge_attachments=True)
+    assert metrics["X-Perf-Stamping"] == "pypdf"
+    assert "X-Perf-Postprocess-Saved-Sec" not in metrics
+    assert "@bottom-right" not in fake_render["html"]
+    (tmp_path / "out.pdf").write_bytes(pdf_bytes)
+    assert page_texts(tmp_path / "out.pdf") == ["PAGE 1 / 3", "PAGE 2 / 3", "TERMS 3 / 3"]
@@ -0,0 +1,101 @@
+import io
+import os
+import gzip
+import xml.parsers.expat
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.api.routes as routes
+from app.main import app
+from app.services.peppol_service import PeppolExtractor
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_data")
+INVOICE_XML = os.path.join(TEST_DATA, "peppol-sample-invoice.xml")
+CREDITNOTE_XML = os.path.join(TEST_DATA, "peppol-sample-creditnote.xml")
+
+
+@pytest.fixture(scope="module")
+def test_client():
+    # No lifespan: these endpoints do not need Saxon
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("endpoint", ["/inspect", "/render"])
+def test_gzip_upload_over_limit_is_rejected(test_client, endpoint):
+    bomb = gzip.compress(b"<Invoice>" + b" " * (2 * 1024 * 1024) + b"</Invoice>")
+    with mock.patch.object(routes, "MAX_DECOMPRESSED_UPLOAD_MB", 1):
+        response = test_client.post(endpoint, files={"file": ("invoice.xml", bomb)})
+    assert response.status_code == 413
+
+
+def test_inspect_sample_files():
+    assert PeppolExtractor.inspect(INVOICE_XML) == {
+        "doc_type": "Invoice",
+        "doc_id": "9901289682",
+        "currency": "EUR",
+        "payable_amount": 15811.94,
+        "iban": "BE62570131425661",
+        "attachment_count": 2
+    }
+    result = PeppolExtractor.inspect(CREDITNOTE_XML)
+    assert result["doc_type"] == "CreditNote"
+    assert result["doc_id"] == "Snippet1"
+    assert result["payable_amount"] == 1656.25
+
+
+def test_inspect_matches_full_extraction():
+    for xml_path in (INVOICE_XML, CREDITNOTE_XML):
+        inspected = PeppolExtractor.inspect(xml_path)
+        sepa = PeppolExtractor.extract_sepa_data(xml_path)
+        assert inspected["doc_id"] == sepa["doc_id"]
+        assert inspected["iban"] == sepa["iban"]
+        assert inspected["payable_amount"] == sepa["amount"]
+        assert inspected["currency"] == sepa["currency"]
+
+
+def test_inspect_rejects_malformed_xml():
+    with pytest.raises(xml.parsers.expat.ExpatError):
+        PeppolExtractor.inspect(io.BytesIO(b"<Invoice><cbc:ID>1"))
+
+
+def test_inspect_endpoint_gzip_and_invalid(test_client):
+    with open(INVOICE_XML, "rb") as f:
+        data = f.read()
+    response = test_client.post("/inspect", files={"file": ("invoice.xml.gz", gzip.compress(data))})
+    assert response.status_code == 200
+    assert response.json()["doc_id"] == "9901289682"
+
+    response = test_client.post("/inspect", files={"file": ("invoice.xml", b"<Invoice")})
+    assert response.status_code == 400
+
+    # Truncated gzip stream
+    response = test_client.post("/inspect", files={"file": ("invoice.xml.gz", gzip.compress(data)[:200])})
+    assert response.status_code == 400
+
+
+def test_inspect_batch_reports_errors_per_file(test_client):
+    with open(INVOICE_XML, "rb") as f:
+        invoice = f.read()
+    with open(CREDITNOTE_XML, "rb") as f:
+        creditnote = f.read()
+    response = test_client.post("/inspect/batch", files=[
+        ("files", ("invoice.xml", invoice)),
+        ("files", ("broken.xml.gz", gzip.compress(invoice)[:200])),
+        ("files", ("creditnote.xml.gz", gzip.compress(creditnote))),
+        ("files", ("bad.xml", b"not xml")),
+    ])
+    assert response.status_code == 200
+    results = response.json()
+    assert [r["filename"] for r in results] == ["invoice.xml", "broken.xml.gz", "creditnote.xml.gz", "bad.xml"]
+    assert results[0]["doc_type"] == "Invoice"
+    assert "error" in results[1]
+    assert results[2]["doc_type"] == "CreditNote"
+    assert "error" in results[3]
+
+
+def test_inspect_batch_is_capped(test_client):
+    with mock.patch.object(routes, "MAX_INSPECT_BATCH_FILES", 1):
+        response = test_client.post("/inspect/batch", files=[("files", ("a.xml", b"<a/>")), ("files", ("b.xml", b"<b/>"))])
+    assert response.status_code == 413
@@ -0,0 +1,117 @@
+import os
+import sys
+import asyncio
+import subprocess
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.scheduler_service import FairScheduler
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def make_scheduler(slots: int, **lanes) -> FairScheduler:
+    options = {"weight": 1.0, "max_concurrency": slots, "queue_depth": 100}
+    return FairScheduler(slots, {name: {**options, **lane} for name, lane in lanes.items()})
+
+
+async def hold_slots(scheduler: FairScheduler, lane: str, count: int):
+    for _ in range(count):
+        await scheduler.acquire(lane)
+
+
+def test_slots_are_shared_by_weight():
+    async def run():
+        scheduler = make_scheduler(1, fast={"weight": 3.0}, slow={"weight": 1.0})
+        await hold_slots(scheduler, "fast", 1)
+        order = []
+
+        async def request(lane):
+            await scheduler.acquire(lane)
+            order.append(lane)
+
+        tasks = [asyncio.create_task(request(lane)) for lane in ("fast", "slow") for _ in range(20)]
+        await asyncio.sleep(0)
+        for _ in range(len(tasks)):
+            scheduler.release(order[-1] if order else "fast")
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(run())
+    # While both lanes are backlogged, the slot is shared 3:1
+    assert order[:16].count("fast") == 12
+    assert order[:16].count("slow") == 4
+
+
+def test_lane_concurrency_limit_leaves_slots_to_other_lanes():
+    async def run():
+        scheduler = make_scheduler(4, interactive={}, bulk={"max_concurrency": 1})
+        bulk = [asyncio.create_task(scheduler.acquire("bulk")) for _ in range(3)]
+        await asyncio.sleep(0)
+        stats = scheduler.stats()["lanes"]["bulk"]
+        assert (stats["running"], stats["queued"]) == (1, 2)
+
+        # The free slots still go to the interactive lane right away
+        await asyncio.wait_for(hold_slots(scheduler, "interactive", 3), timeout=1)
+        assert scheduler.running == 4
+
+        scheduler.release("bulk")
+        await asyncio.sleep(0)
+        assert scheduler.lanes["bulk"].running == 1
+        for task in bulk:
+            task.cancel()
+        await asyncio.gather(*bulk, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+def test_full_queue_is_rejected_with_429():
+    async def run():
+        scheduler = make_scheduler(1, bulk={"queue_depth": 1})
+        await hold_slots(scheduler, "bulk", 1)
+        queued = asyncio.create_task(scheduler.acquire("bulk"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as exc_info:
+            await scheduler.acquire("bulk")
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.headers["Retry-After"] == "1"
+        assert scheduler.lanes["bulk"].rejected == 1
+
+        scheduler.release("bulk")
+        await queued
+
+    asyncio.run(run())
+
+
+def test_cancelled_request_leaves_queue_without_leaking_a_slot():
+    async def run():
+        scheduler = make_scheduler(1, interactive={})
+        await hold_slots(scheduler, "interactive", 1)
+        queued = asyncio.create_task(scheduler.acquire("interactive"))
+        await asyncio.sleep(0)
+        assert len(scheduler.lanes["interactive"].queue) == 1
+
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert len(scheduler.lanes["interactive"].queue) == 0
+
+        scheduler.release("interactive")
+        assert scheduler.running == 0
+        await asyncio.wait_for(scheduler.acquire("interactive"), timeout=1)
+        assert scheduler.running == 1
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("env", [{"SCHEDULER_DEFAULT_LANE": "urgent"}, {"PRIORITY_API_KEYS": "key1:bulk,key2:urgent"}])
+def test_unknown_lanes_are_rejected_at_startup(env):
+    result = subprocess.run(
+        [sys.executable, "-c", "import app.core.config"],
+        cwd=PROJECT_ROOT, env={**os.environ, **env}, capture_output=True, text=True
+    )
+    assert result.returncode != 0
+    assert "urgent" in result.stderr